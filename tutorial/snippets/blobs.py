@@ -0,0 +1,142 @@
+"""
+Content-addressed storage for snippet code bodies and their renders.
+
+When `SNIPPETS_BLOB_STORAGE` is enabled, the `code` and `highlighted` text of
+a `Snippet` is stored once in the `SnippetBlob` table, keyed by its SHA-256
+digest and reference counted, instead of inline on every row.
+
+The helpers here take the model classes as arguments so that they can be
+shared by the models, the `snippet_blobs` management command and data
+migrations (which only have access to historical models).
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef
+
+# Pairs of (inline text column, blob foreign key) on `Snippet`.
+BLOB_FIELDS = [('code', 'code_blob'), ('highlighted', 'highlighted_blob')]
+
+
+def blob_storage_enabled():
+    return getattr(settings, 'SNIPPETS_BLOB_STORAGE', False)
+
+
+def content_digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def acquire(blob_model, text, using=None):
+    """
+    Take a reference to the blob holding `text`, creating it if needed,
+    and return its digest. Empty text is never stored and returns `None`.
+    """
+    if not text:
+        return None
+    digest = content_digest(text)
+    blobs = blob_model._default_manager.db_manager(using)
+    while True:
+        # Look up and raise the count in one UPDATE. `collect()` only deletes
+        # blobs whose count is still zero in its own single DELETE, so the
+        # blob either survives with the raised count or is recreated below.
+        if blobs.filter(pk=digest).update(refcount=F('refcount') + 1):
+            return digest
+        try:
+            with transaction.atomic(using=blobs.db):
+                blobs.create(digest=digest, content=text, refcount=1)
+            return digest
+        except IntegrityError:
+            # Somebody else created it first; take a reference on theirs.
+            continue
+
+
+def release(blob_model, digest, using=None):
+    """
+    Drop a reference to a blob. Blobs are not deleted here; see `collect()`.
+    """
+    if digest is None:
+        return
+    blob_model._default_manager.db_manager(using).filter(pk=digest).update(
+        refcount=F('refcount') - 1)
+
+
+def collect(blob_model, snippet_model, using=None):
+    """
+    Delete blobs whose reference count has reached zero and that no snippet
+    points at any more. Returns the number of blobs removed.
+
+    This is one conditional DELETE rather than `QuerySet.delete()`, which
+    selects the rows first and would remove a blob whose count `acquire()`
+    raised in between.
+    """
+    blobs = blob_model._default_manager.db_manager(using)
+    snippets = snippet_model._default_manager.db_manager(using)
+    garbage = blobs.filter(refcount__lte=0)
+    for _, blob_field in BLOB_FIELDS:
+        garbage = garbage.exclude(
+            Exists(snippets.filter(**{blob_field: OuterRef('pk')})))
+    return garbage._raw_delete(blobs.db)
+
+
+def recount(blob_model, snippet_model, using=None):
+    """
+    Recompute every blob's reference count from the snippets that point at
+    it, repairing drift left behind by interrupted writes.
+    """
+    blobs = blob_model._default_manager.db_manager(using)
+    snippets = snippet_model._default_manager.db_manager(using)
+    counts = {}
+    for _, blob_field in BLOB_FIELDS:
+        for digest in snippets.exclude(**{blob_field: None}).values_list(
+                blob_field, flat=True).iterator():
+            counts[digest] = counts.get(digest, 0) + 1
+    with transaction.atomic(using=blobs.db):
+        for blob in blobs.all().only('pk', 'refcount'):
+            refcount = counts.get(blob.pk, 0)
+            if blob.refcount != refcount:
+                blobs.filter(pk=blob.pk).update(refcount=refcount)
+
+
+def pack(blob_model, snippet_model, using=None):
+    """
+    Move the text of every snippet still stored inline into blobs.
+    Returns the number of snippets packed.
+    """
+    snippets = snippet_model._default_manager.db_manager(using)
+    packed = 0
+    rows = snippets.filter(code_blob=None, highlighted_blob=None).values_list(
+        'pk', 'code', 'highlighted')
+    for pk, code, highlighted in rows.iterator():
+        with transaction.atomic(using=snippets.db):
+            snippets.filter(pk=pk).update(
+                code='', code_blob=acquire(blob_model, code, using),
+                highlighted='',
+                highlighted_blob=acquire(blob_model, highlighted, using))
+        packed += 1
+    return packed
+
+
+def unpack(blob_model, snippet_model, using=None):
+    """
+    Copy blob text back inline onto every snippet that references a blob.
+    Returns the number of snippets unpacked.
+    """
+    snippets = snippet_model._default_manager.db_manager(using)
+    blobs = blob_model._default_manager.db_manager(using)
+    unpacked = 0
+    rows = snippets.exclude(code_blob=None, highlighted_blob=None).values_list(
+        'pk', 'code_blob', 'highlighted_blob')
+    for pk, code_digest, highlighted_digest in rows.iterator():
+        values = {}
+        for (text_field, blob_field), digest in zip(
+                BLOB_FIELDS, (code_digest, highlighted_digest)):
+            if digest is not None:
+                values[text_field] = blobs.get(pk=digest).content
+                values[blob_field] = None
+        with transaction.atomic(using=snippets.db):
+            snippets.filter(pk=pk).update(**values)
+            release(blob_model, code_digest, using)
+            release(blob_model, highlighted_digest, using)
+        unpacked += 1
+    return unpacked
@@ -0,0 +1,216 @@
+"""
+Cheap language detection for snippets posted without a `language`.
+
+Pygments' `guess_lexer` runs `analyse_text` for every registered lexer.
+Instead, candidates are narrowed with precomputed heuristics first:
+
+1. a file name hint taken from the snippet title (`*.py`, `Makefile`...),
+2. the interpreter named by a `#!` line,
+3. keyword-frequency fingerprints of common languages,
+
+and only the few remaining candidates have their `analyse_text` run. Every
+step looks at a bounded prefix of the code, and the whole detection stops
+refining once `SNIPPETS_DETECT_LANGUAGE_BUDGET` seconds have passed.
+Results are cached by content hash.
+"""
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from pygments.lexers import find_lexer_class_by_name, get_all_lexers
+from pygments.util import ClassNotFound
+from snippets.blobs import content_digest
+
+# Language used when nothing looks like code.
+FALLBACK_LANGUAGE = 'text'
+
+# Only this much of a snippet is looked at.
+SAMPLE_SIZE = 4096
+
+# How many fingerprint matches go on to `analyse_text`.
+MAX_CANDIDATES = 4
+
+# Some `analyse_text` implementations are crude (Python's returns 1.0 for
+# any `import `), so they only count for half as much as the fingerprints.
+ANALYSE_WEIGHT = 0.5
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
+# Interpreters whose name is not itself a Pygments alias.
+INTERPRETERS = {
+    'sh': 'bash', 'zsh': 'bash', 'ksh': 'bash', 'dash': 'bash',
+    'node': 'javascript', 'nodejs': 'javascript', 'deno': 'typescript',
+    'pypy': 'python', 'rscript': 'r', 'runghc': 'haskell', 'escript': 'erlang',
+}
+
+# Tokens that are frequent in one language and rare in others, with weights.
+# Runs of whitespace are `[ \t]*` rather than `\s*`: with `re.MULTILINE` a
+# `^\s*` swallows every following blank line and backtracks quadratically.
+FINGERPRINTS = {
+    'python': [(r'^[ \t]*def \w+\(.*\):', 3), (r'^[ \t]*(from [\w.]+ )?import [\w., ]+$', 2),
+               (r'\bself\b', 1), (r'\belif\b', 3), (r'\b(None|True|False)\b', 1),
+               (r'^[ \t]*class \w+(\(.*\))?:', 3), (r'\bprint\(', 1)],
+    'javascript': [(r'\bfunction\b', 2), (r'\b(const|let|var) \w+ =', 2),
+                   (r'=>', 1), (r'\bconsole\.log\(', 3), (r'\bdocument\.', 3),
+                   (r'\brequire\(', 2), (r'===', 2)],
+    'typescript': [(r'\binterface \w+ \{', 3), (r'\b\w+: (string|number|boolean)\b', 4),
+                   (r'\b(const|let) \w+ =', 1), (r'=>', 1), (r'^[ \t]*export ', 1)],
+    'java': [(r'\bpublic (static )?(class|void|final)\b', 3), (r'\bSystem\.out\.', 4),
+             (r'\bprivate \w+ \w+;', 2), (r'^[ \t]*import java\.', 4), (r'@Override', 3)],
+    'c': [(r'^[ \t]*#include <\w+\.h>', 3), (r'\bprintf\(', 2), (r'\bint main\(', 2),
+          (r'\bmalloc\(', 3), (r'\bstruct \w+', 1), (r'->', 1)],
+    'cpp': [(r'^[ \t]*#include <\w+>', 3), (r'\bstd::', 4), (r'\bcout\b', 3),
+            (r'\btemplate[ \t]*<', 3), (r'\bnamespace\b', 2), (r'::', 1)],
+    'csharp': [(r'^[ \t]*using System', 4), (r'\bnamespace \w', 2), (r'\bConsole\.Write', 4),
+               (r'\bpublic (static )?(class|void)\b', 2), (r'\bstring\[\]', 2)],
+    'go': [(r'^[ \t]*package \w+', 3), (r'\bfunc \w*\(', 3), (r':=', 2),
+           (r'\bfmt\.', 4), (r'^[ \t]*import \(', 3)],
+    'rust': [(r'\bfn \w+\(', 3), (r'\blet mut\b', 4), (r'\bprintln!', 4),
+             (r'\bimpl\b', 2), (r'&str\b', 3), (r'\buse \w+::', 3)],
+    'ruby': [(r'^[ \t]*def \w+[^:]*$', 2), (r'^[ \t]*end[ \t]*$', 2), (r'\bputs\b', 3),
+             (r'\battr_accessor\b', 4), (r'\bdo \|\w+\|', 4), (r'^[ \t]*require [\'"]', 3)],
+    'php': [(r'<\?php', 6), (r'\$\w+[ \t]*=', 2), (r'\becho\b', 1), (r'->', 1),
+            (r'\bfunction \w+\(\$', 4)],
+    'bash': [(r'^[ \t]*(if|while) \[', 3), (r'\bfi\b', 3), (r'\becho\b', 1),
+             (r'\$\{?\w+\}?', 1), (r'^[ \t]*export \w+=', 2), (r'\bdone\b', 2)],
+    'sql': [(r'\bSELECT\b', 2), (r'\bFROM\b', 2), (r'\b(INSERT INTO|UPDATE \w+ SET|DELETE FROM)\b', 4),
+            (r'\bCREATE TABLE\b', 4), (r'\bWHERE\b', 2), (r'\b(JOIN|GROUP BY|ORDER BY)\b', 2)],
+    'html': [(r'<!DOCTYPE html', 6), (r'</?(html|head|body|div|span|p|a)\b', 2),
+             (r'<\w+ [\w-]+="[^"\n]*"', 1)],
+    'css': [(r'^[ \t]*[.#]?[\w-]+[ \t]*\{', 2), (r'^[ \t]*[\w-]+:[ \t]*[^;\n]+;[ \t]*$', 2),
+            (r'\b\d+(px|em|rem)\b', 2), (r'@media\b', 4)],
+    'json': [(r'^[ \t]*[\[{]', 1), (r'"[\w-]+"[ \t]*:', 3), (r'\b(true|false|null)\b', 1)],
+    'yaml': [(r'^[ \t]*[\w-]+:\s', 2), (r'^[ \t]*- ', 1), (r'^---[ \t]*$', 3)],
+}
+FINGERPRINTS = {
+    language: [(re.compile(pattern, re.MULTILINE), weight) for pattern, weight in patterns]
+    for language, patterns in FINGERPRINTS.items()
+}
+
+
+def _build_filename_hints():
+    """
+    Map file extensions and exact file names to the primary aliases of the
+    lexers that claim them.
+    """
+    extensions, names = {}, {}
+    for _, aliases, patterns, _ in get_all_lexers():
+        if not aliases:
+            continue
+        for pattern in patterns:
+            if re.fullmatch(r'\*\.[\w+-]+', pattern):
+                extensions.setdefault(pattern[1:].lower(), []).append(aliases[0])
+            elif not any(char in pattern for char in '*?['):
+                names.setdefault(pattern, []).append(aliases[0])
+    return extensions, names
+
+
+EXTENSION_HINTS, FILENAME_HINTS = _build_filename_hints()
+
+
+def detection_enabled():
+    return getattr(settings, 'SNIPPETS_DETECT_LANGUAGE', False)
+
+
+def filename_hint(filename):
+    """
+    Return the part of `filename` that the hints look at: a known file name
+    or its extension.
+    """
+    filename = os.path.basename((filename or '').strip())
+    if filename in FILENAME_HINTS:
+        return filename
+    return os.path.splitext(filename)[1].lower()
+
+
+def filename_candidates(filename):
+    hint = filename_hint(filename)
+    return FILENAME_HINTS.get(hint) or EXTENSION_HINTS.get(hint, [])
+
+
+def shebang_language(code):
+    if not code.startswith('#!'):
+        return None
+    words = code[2:].split('\n', 1)[0].split()
+    if words and os.path.basename(words[0]) == 'env':
+        words = [word for word in words[1:] if not word.startswith('-')]
+    if not words:
+        return None
+    interpreter = re.sub(r'[\d.]+$', '', os.path.basename(words[0])).lower()
+    interpreter = INTERPRETERS.get(interpreter, interpreter)
+    try:
+        return find_lexer_class_by_name(interpreter).aliases[0]
+    except ClassNotFound:
+        return None
+
+
+def fingerprint_scores(sample, deadline=None):
+    """
+    Return `{language: score}` for every fingerprinted language that matches,
+    where the score is the weighted share of all matches. Languages not
+    reached by `deadline` (a `time.perf_counter()` value) are left out.
+    """
+    scores = {}
+    for language, patterns in FINGERPRINTS.items():
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+        score = sum(weight * len(pattern.findall(sample)) for pattern, weight in patterns)
+        if score:
+            scores[language] = score
+    total = sum(scores.values())
+    return {language: score / total for language, score in scores.items()}
+
+
+def _detect(code, filename):
+    # The budget covers every step, as `code` comes straight from requests.
+    budget = getattr(settings, 'SNIPPETS_DETECT_LANGUAGE_BUDGET', 0.05)
+    deadline = time.perf_counter() + budget
+    sample = code[:SAMPLE_SIZE]
+
+    if filename:
+        candidates = filename_candidates(filename)
+        if len(candidates) == 1:
+            return candidates[0]
+    else:
+        candidates = []
+
+    language = shebang_language(sample)
+    if language:
+        return language
+
+    scores = fingerprint_scores(sample, deadline)
+    if not candidates:
+        candidates = sorted(scores, key=scores.get, reverse=True)[:MAX_CANDIDATES]
+    if not candidates:
+        return FALLBACK_LANGUAGE
+
+    # `analyse_text` is the expensive part, so it only refines the best
+    # fingerprint match for as long as the budget lasts.
+    best = max(candidates, key=lambda candidate: scores.get(candidate, 0.0))
+    best_score = scores.get(best, 0.0)
+    for candidate in candidates:
+        if time.perf_counter() > deadline:
+            break
+        score = scores.get(candidate, 0.0)
+        try:
+            score += ANALYSE_WEIGHT * find_lexer_class_by_name(candidate).analyse_text(sample)
+        except ClassNotFound:
+            continue
+        if score > best_score:
+            best, best_score = candidate, score
+    return best
+
+
+def detect_language(code, filename=''):
+    """
+    Return the Pygments alias that best fits `code`, using `filename` (the
+    snippet title) as a hint when it looks like one.
+    """
+    key = f'snippets-language:{content_digest(code)}:{filename_hint(filename)}'
+    language = cache.get(key)
+    if language is None:
+        language = _detect(code, filename)
+        cache.set(key, language, CACHE_TIMEOUT)
+    return language
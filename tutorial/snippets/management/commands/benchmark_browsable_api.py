@@ -0,0 +1,98 @@
+import statistics
+import time
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+from rest_framework import renderers, serializers
+from rest_framework.test import APIRequestFactory, force_authenticate
+from snippets.models import Snippet
+from snippets.renderers import BrowsableAPIRenderer
+from snippets.serializers import SnippetSerializer
+from snippets.sharding import shard_map
+from snippets.views import SnippetViewSet
+
+
+@contextmanager
+def stock_config():
+    """
+    Django's and REST framework's defaults: templates re-parsed on every
+    request (as with DEBUG on), widgets rendered with the default form
+    renderer and choices processed per field.
+    """
+    templates = [{**engine, 'APP_DIRS': True,
+                  'OPTIONS': {**engine.get('OPTIONS', {}), 'loaders': None, 'debug': True}}
+                 for engine in settings.TEMPLATES]
+    with override_settings(TEMPLATES=templates,
+                           FORM_RENDERER='django.forms.renderers.DjangoTemplates'), \
+            mock.patch.object(SnippetSerializer, 'serializer_choice_field',
+                              serializers.ChoiceField):
+        yield
+
+
+@contextmanager
+def tuned_config():
+    """The project's settings as deployed, with DEBUG and so template caching off."""
+    templates = [{**engine, 'OPTIONS': {**engine.get('OPTIONS', {}), 'debug': False}}
+                 for engine in settings.TEMPLATES]
+    with override_settings(TEMPLATES=templates):
+        yield
+
+
+RENDERERS = [
+    ('json', renderers.JSONRenderer, stock_config),
+    ('browsable (stock)', renderers.BrowsableAPIRenderer, stock_config),
+    ('browsable (cached)', BrowsableAPIRenderer, tuned_config),
+]
+
+
+class Command(BaseCommand):
+    help = ('Compare the cost of rendering the snippet list and detail views as JSON, '
+            'with the stock browsable API and configuration, and with cached '
+            'templates and choice fields. '
+            'Works on throwaway data that is rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Requests timed per view and renderer.')
+
+    def handle(self, *args, requests, **options):
+        with ExitStack() as stack:
+            for alias in shard_map.aliases():
+                stack.enter_context(transaction.atomic(using=alias))
+            self.run(requests)
+            for alias in shard_map.aliases():
+                transaction.set_rollback(True, using=alias)
+
+    def run(self, requests):
+        user = User.objects.create_user(username='benchmark-browsable-api')
+        snippets = [Snippet.objects.create(code=f'print({i})', owner=user) for i in range(10)]
+        # A host that passes ALLOWED_HOSTS' development defaults.
+        factory = APIRequestFactory(SERVER_NAME='localhost')
+
+        # The same actions as the router, so that the browsable API shows its forms.
+        views = [
+            ('list', {'get': 'list', 'post': 'create'}, '/snippets/', {}),
+            ('detail', {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+                        'delete': 'destroy'},
+             f'/snippets/{snippets[0].pk}/', {'pk': snippets[0].pk}),
+        ]
+        for view_name, actions, url, kwargs in views:
+            for renderer_name, renderer_class, config in RENDERERS:
+                view = SnippetViewSet.as_view(actions, renderer_classes=[renderer_class])
+                timings = []
+                with config():
+                    for _ in range(requests):
+                        request = factory.get(url)
+                        force_authenticate(request, user=user)
+                        start = time.perf_counter()
+                        response = view(request, **kwargs).render()
+                        timings.append((time.perf_counter() - start) * 1000)
+                self.stdout.write(
+                    f'{view_name:6} {renderer_name:18} mean {statistics.mean(timings):7.2f} ms  '
+                    f'median {statistics.median(timings):7.2f} ms  '
+                    f'{len(response.content) / 1024:6.1f} KB')
@@ -0,0 +1,65 @@
+import statistics
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from pygments.lexers import guess_lexer
+from pygments.util import ClassNotFound
+from snippets import detection
+
+SNIPPETS_DIR = Path(detection.__file__).resolve().parent
+# The fingerprints are tuned on `language_corpus`; `language_heldout` is kept
+# out of that loop so its accuracy says how well they generalise.
+CORPUS_DIRS = [SNIPPETS_DIR / 'language_corpus', SNIPPETS_DIR / 'language_heldout']
+
+
+def guess_with_pygments(code, filename):
+    try:
+        return guess_lexer(code).aliases[0]
+    except ClassNotFound:
+        return detection.FALLBACK_LANGUAGE
+
+
+class Command(BaseCommand):
+    help = ('Measure accuracy and latency of snippet language detection against '
+            "Pygments' guess_lexer on a labelled corpus (one directory per language).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', action='append',
+                            help='Directory holding <language>/<sample> files; repeat '
+                                 'for several. Defaults to the tuning and held-out corpora.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Times each sample is classified.')
+
+    def handle(self, *args, corpus, repeat, **options):
+        for directory in corpus or CORPUS_DIRS:
+            samples = [(path.parent.name, path.read_text())
+                       for path in sorted(Path(directory).glob('*/*')) if path.is_file()]
+            if not samples:
+                raise CommandError(f'No samples found in {directory}.')
+
+            self.stdout.write(f'{directory}: {len(samples)} samples, {repeat} run(s) each')
+            # The uncached path, so that the heuristics themselves are measured.
+            self.report('detect_language', detection._detect, samples, repeat)
+            self.report('guess_lexer', guess_with_pygments, samples, repeat)
+
+    def report(self, name, classify, samples, repeat):
+        correct, timings, misses = 0, [], []
+        for language, code in samples:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = classify(code, '')
+                timings.append((time.perf_counter() - start) * 1000)
+            if result == language:
+                correct += 1
+            else:
+                misses.append(f'{language}->{result}')
+
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        self.stdout.write(
+            f'{name:16} accuracy {correct}/{len(samples)} ({correct / len(samples):.0%})  '
+            f'mean {statistics.mean(timings):.2f} ms  p95 {p95:.2f} ms  '
+            f'max {timings[-1]:.2f} ms')
+        if misses:
+            self.stdout.write(f'{"":16} misses: {", ".join(misses)}')
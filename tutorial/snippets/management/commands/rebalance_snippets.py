@@ -0,0 +1,202 @@
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models.functions import Mod
+from snippets import blobs, sharding
+from snippets.models import ShardBucket, Snippet, SnippetBlob
+
+# Everything a copy of a snippet carries over from the original.
+COPIED_FIELDS = ['created', 'title', 'code', 'linenos', 'language', 'style',
+                 'owner_id', 'highlighted']
+
+
+def row_values(snippet):
+    return [getattr(snippet, field) for field in COPIED_FIELDS]
+
+
+class Command(BaseCommand):
+    help = ('Move buckets of snippet owners between the shards in SNIPPETS_SHARDS. '
+            'Buckets that are not pinned stay on the first listed shard, so run '
+            'with --pin before reordering SNIPPETS_SHARDS, and without arguments '
+            'to spread buckets evenly over the listed shards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pin', action='store_true',
+                            help='Record the current shard of every bucket and exit.')
+        parser.add_argument('--bucket', type=int,
+                            help='Move only this bucket (requires --to).')
+        parser.add_argument('--to', dest='target',
+                            help='Shard alias to move --bucket to.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print the moves without performing them.')
+        parser.add_argument('--wait', type=float, default=sharding.SHARD_MAP_TTL,
+                            help='Seconds to wait, once for all moved buckets, before '
+                                 'reconciling and removing them from their old shards '
+                                 'so that other processes can pick up the new shard map.')
+
+    def handle(self, *args, pin, bucket, target, dry_run, wait, **options):
+        placement = {b: sharding.shard_map.shard_for_bucket(b)
+                     for b in range(sharding.BUCKETS)}
+        if not dry_run:
+            # Tickets must be past the legacy ids before any leave the
+            # default database, where allocation looks for them.
+            sharding.tickets.reserve()
+
+        if pin:
+            if not dry_run:
+                by_alias = defaultdict(list)
+                for b, alias in placement.items():
+                    by_alias[alias].append(b)
+                with transaction.atomic(using='default'):
+                    for alias, buckets in by_alias.items():
+                        self.pin(buckets, alias)
+            self.stdout.write(f'Pinned {len(placement)} bucket(s).')
+            return
+
+        if bucket is not None or target is not None:
+            if bucket is None or target is None:
+                raise CommandError('--bucket and --to must be given together.')
+            if not 0 <= bucket < sharding.BUCKETS:
+                raise CommandError(f'Bucket must be between 0 and {sharding.BUCKETS - 1}.')
+            moves = [(bucket, placement[bucket], target)]
+        else:
+            moves = self.plan(placement, sharding.shard_aliases())
+
+        moves = [(b, source, dest) for b, source, dest in moves if source != dest]
+        for b, source, dest in moves:
+            if dest not in sharding.shard_aliases():
+                raise CommandError(f'{dest!r} is not listed in SNIPPETS_SHARDS.')
+        if dry_run:
+            for b, source, dest in moves:
+                self.stdout.write(f'Would move bucket {b}: {source} -> {dest}')
+            return
+
+        # Buckets are moved in groups sharing a source and target, and every
+        # group is copied and repointed first, so that the wait for other
+        # processes' shard maps is only paid once.
+        groups = defaultdict(list)
+        for b, source, dest in moves:
+            groups[source, dest].append(b)
+        copies = {(source, dest): self.start_move(buckets, source, dest)
+                  for (source, dest), buckets in groups.items()}
+        sharding.shard_map.clear()
+        if moves and wait:
+            time.sleep(wait)
+        for (source, dest), buckets in groups.items():
+            counts = self.finish_move(buckets, source, dest, copies[source, dest])
+            for b in buckets:
+                self.stdout.write(f'Moved bucket {b}: {source} -> {dest} ({counts[b]} snippet(s))')
+
+    def plan(self, placement, aliases):
+        """
+        Return the fewest `(bucket, source, target)` moves that leave every
+        shard in `aliases` with an equal share of the buckets.
+        """
+        quota = {alias: sharding.BUCKETS // len(aliases) for alias in aliases}
+        for alias in aliases[:sharding.BUCKETS % len(aliases)]:
+            quota[alias] += 1
+
+        # Buckets pinned to aliases that are no longer listed have no quota,
+        # so they are always moved.
+        homeless = []
+        for b, alias in sorted(placement.items()):
+            if quota.get(alias, 0) > 0:
+                quota[alias] -= 1
+            else:
+                homeless.append(b)
+
+        moves = []
+        free = [alias for alias in aliases for _ in range(quota[alias])]
+        for b, alias in zip(homeless, free):
+            moves.append((b, placement[b], alias))
+        return moves
+
+    def snapshot(self, rows):
+        """
+        Return `{pk: snippet}` for `rows`, with the text of each snippet
+        loaded whether it is inline or in a blob.
+        """
+        return {snippet.pk: snippet for snippet in
+                rows.select_related('code_blob', 'highlighted_blob').iterator()}
+
+    def copy(self, snippets, target):
+        """
+        Write `snippets` to `target`, replacing any copy already there.
+        """
+        if not snippets:
+            return
+        on_target = Snippet.objects.using(target)
+        with transaction.atomic(using=target):
+            # Through `delete()` so that replaced copies release their blobs.
+            on_target.filter(pk__in=[snippet.pk for snippet in snippets]).delete()
+            for snippet in snippets:
+                copy = Snippet(pk=snippet.pk, title=snippet.title, code=snippet.code,
+                               linenos=snippet.linenos, language=snippet.language,
+                               style=snippet.style, owner_id=snippet.owner_id,
+                               highlighted=snippet.highlighted)
+                if blobs.blob_storage_enabled():
+                    copy.code_blob_id = blobs.acquire(SnippetBlob, copy.code, target)
+                    copy.highlighted_blob_id = blobs.acquire(SnippetBlob, copy.highlighted, target)
+                # `bulk_create` keeps the rendered HTML, but stamps a new date.
+                on_target.bulk_create([copy])
+                on_target.filter(pk=snippet.pk).update(created=snippet.created)
+
+    def pin(self, buckets, alias):
+        """
+        Record `alias` as the shard of every bucket in `buckets`.
+        """
+        pinned = ShardBucket.objects.filter(bucket__in=buckets)
+        existing = set(pinned.values_list('bucket', flat=True))
+        pinned.update(alias=alias)
+        ShardBucket.objects.bulk_create(
+            [ShardBucket(bucket=b, alias=alias) for b in buckets if b not in existing])
+
+    def bucket_rows(self, buckets, alias):
+        return (Snippet.objects.using(alias)
+                .annotate(bucket=Mod('owner_id', sharding.BUCKETS))
+                .filter(bucket__in=buckets))
+
+    def start_move(self, buckets, source, target):
+        """
+        Copy the snippets of `buckets` to `target` and point the shard map
+        at it. Returns the snippets that were copied.
+        """
+        copied = self.snapshot(self.bucket_rows(buckets, source))
+        self.copy(copied.values(), target)
+        with transaction.atomic(using='default'):
+            self.pin(buckets, target)
+        return copied
+
+    def finish_move(self, buckets, source, target, copied):
+        """
+        Remove the snippets of moved `buckets` from `source`. Returns
+        `{bucket: snippet count}`.
+
+        Processes still using the old shard map may have kept writing to
+        `source` since `start_move()`, so the snippets they created, changed
+        or deleted are reconciled onto `target` first, and only the snippets
+        that were reconciled are removed from `source`.
+        """
+        rows = self.bucket_rows(buckets, source)
+        with transaction.atomic(using=source):
+            # Locked where the database supports it, so late writes wait.
+            current = self.snapshot(rows.select_for_update(of=('self',)))
+            changed = [snippet for pk, snippet in current.items()
+                       if pk not in copied or row_values(snippet) != row_values(copied[pk])]
+            self.copy(changed, target)
+            deleted = copied.keys() - current.keys()
+            if deleted:
+                Snippet.objects.using(target).filter(pk__in=deleted).delete()
+            if current:
+                rows.filter(pk__in=list(current)).delete()
+
+        left = rows.count()
+        if left:
+            self.stderr.write(f'{left} snippet(s) written to {source} while buckets were '
+                              f'moving to {target} were left there; run the move again.')
+        counts = dict.fromkeys(buckets, 0)
+        for snippet in current.values():
+            counts[snippet.bucket] += 1
+        return counts
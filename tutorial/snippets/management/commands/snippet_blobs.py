@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from snippets import blobs
+from snippets.models import Snippet, SnippetBlob
+
+
+class Command(BaseCommand):
+    help = 'Maintain the content-addressed snippet blob store.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'operation', choices=['pack', 'unpack', 'recount', 'gc'],
+            help='pack: move inline snippet text into blobs. '
+                 'unpack: copy blob text back inline. '
+                 'recount: rebuild blob reference counts. '
+                 'gc: delete unreferenced blobs.')
+        parser.add_argument('--database', default='default',
+                            help='Database alias to operate on.')
+
+    def handle(self, *args, operation, database, **options):
+        if operation == 'pack':
+            count = blobs.pack(SnippetBlob, Snippet, using=database)
+            self.stdout.write(f'Packed {count} snippet(s).')
+        elif operation == 'unpack':
+            count = blobs.unpack(SnippetBlob, Snippet, using=database)
+            self.stdout.write(f'Unpacked {count} snippet(s).')
+        elif operation == 'recount':
+            blobs.recount(SnippetBlob, Snippet, using=database)
+            self.stdout.write('Reference counts rebuilt.')
+        else:
+            count = blobs.collect(SnippetBlob, Snippet, using=database)
+            self.stdout.write(f'Collected {count} blob(s).')
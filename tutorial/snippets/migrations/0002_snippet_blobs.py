@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+import snippets.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnippetBlob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('content', models.TextField()),
+                ('refcount', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='snippet',
+            name='code',
+            field=snippets.models.BlobTextField(blob_field='code_blob'),
+        ),
+        migrations.AlterField(
+            model_name='snippet',
+            name='highlighted',
+            field=snippets.models.BlobTextField(blob_field='highlighted_blob'),
+        ),
+        migrations.AddField(
+            model_name='snippet',
+            name='code_blob',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='snippets.snippetblob'),
+        ),
+        migrations.AddField(
+            model_name='snippet',
+            name='highlighted_blob',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='snippets.snippetblob'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+from snippets import blobs
+
+
+def pack_snippets(apps, schema_editor):
+    """
+    Move existing snippet text into blobs when blob storage is enabled.
+    Otherwise rows stay inline; `manage.py snippet_blobs pack` can move
+    them later.
+    """
+    if blobs.blob_storage_enabled():
+        blobs.pack(apps.get_model('snippets', 'SnippetBlob'),
+                   apps.get_model('snippets', 'Snippet'),
+                   using=schema_editor.connection.alias)
+
+
+def unpack_snippets(apps, schema_editor):
+    SnippetBlob = apps.get_model('snippets', 'SnippetBlob')
+    Snippet = apps.get_model('snippets', 'Snippet')
+    using = schema_editor.connection.alias
+    blobs.unpack(SnippetBlob, Snippet, using=using)
+    blobs.collect(SnippetBlob, Snippet, using=using)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0002_snippet_blobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(pack_snippets, unpack_snippets),
+    ]
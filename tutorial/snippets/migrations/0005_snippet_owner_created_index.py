@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snippets', '0004_snippet_shards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='snippet',
+            index=models.Index(fields=['owner', 'created'], name='snippets_sn_owner_i_f2bd25_idx'),
+        ),
+    ]
@@ -1,37 +1,182 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models.query_utils import DeferredAttribute
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from pygments.formatters.html import HtmlFormatter
 from pygments import highlight
 from pygments.lexers import get_all_lexers, get_lexer_by_name
 from pygments.styles import get_all_styles
+from snippets import blobs, sharding
 
 LEXERS = [item for item in get_all_lexers() if item[1]]
 LANGUAGE_CHOICES = sorted([(item[1][0], item[0]) for item in LEXERS])
 STYLE_CHOICES = sorted([(item, item) for item in get_all_styles()])
 
 
+class BlobTextDescriptor(DeferredAttribute):
+    """
+    Resolve the text of a `BlobTextField` from its blob when the row only
+    holds a reference to it.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if not value and getattr(instance, self.field.blob_attname) is not None:
+            value = getattr(instance, self.field.blob_field).content
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+class BlobTextField(models.TextField):
+    """
+    A text column whose value may live in a `SnippetBlob` instead.
+    The column is left empty whenever `blob_field` points at a blob.
+    """
+    descriptor_class = BlobTextDescriptor
+
+    def __init__(self, *args, blob_field=None, **kwargs):
+        self.blob_field = blob_field
+        super().__init__(*args, **kwargs)
+
+    @property
+    def blob_attname(self):
+        return self.model._meta.get_field(self.blob_field).attname
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['blob_field'] = self.blob_field
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        if getattr(model_instance, self.blob_attname) is not None:
+            return ''
+        return super().pre_save(model_instance, add)
+
+
+class SnippetBlob(models.Model):
+    """
+    A piece of snippet text stored once, keyed by its SHA-256 digest.
+    """
+    digest = models.CharField(max_length=64, primary_key=True)
+    content = models.TextField()
+    refcount = models.IntegerField(default=0)
+
+
+class ShardBucket(models.Model):
+    """
+    Pins a bucket of owners to a shard, overriding the round-robin placement.
+    """
+    bucket = models.IntegerField(primary_key=True)
+    alias = models.CharField(max_length=100)
+
+
+class SnippetTicket(models.Model):
+    """
+    Source of globally unique ids for snippets spread across shards.
+    """
+
+
+class SnippetQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        """
+        Unless a database was chosen explicitly, let `save()` route the new
+        snippet to its owner's shard.
+        """
+        if self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+
 class Snippet(models.Model):
     created = models.DateTimeField(auto_now_add=True) # auto field
     title = models.CharField(max_length=100, blank=True, default='')
-    code = models.TextField()
+    code = BlobTextField(blob_field='code_blob')
     linenos = models.BooleanField(default=False)
     language = models.CharField(choices=LANGUAGE_CHOICES, default='python', max_length=100)
     style = models.CharField(choices=STYLE_CHOICES, default='friendly', max_length=100)
-    owner = models.ForeignKey('auth.User', related_name='snippets', on_delete=models.CASCADE)
-    highlighted = models.TextField()
+    owner = models.ForeignKey('auth.User', related_name='snippets', on_delete=models.CASCADE,
+                              db_constraint=False)
+    highlighted = BlobTextField(blob_field='highlighted_blob')
+    code_blob = models.ForeignKey(SnippetBlob, related_name='+', null=True, blank=True,
+                                  editable=False, on_delete=models.PROTECT)
+    highlighted_blob = models.ForeignKey(SnippetBlob, related_name='+', null=True, blank=True,
+                                         editable=False, on_delete=models.PROTECT)
+
+    objects = SnippetQuerySet.as_manager()
 
     class Meta:
         ordering = ['created']
+        indexes = [models.Index(fields=['owner', 'created'])]
 
     def save(self, *args, **kwargs):
         """
         Use the `pygments` library to create a highlighted HTML
         representation of the code snippet.
+
+        With `SNIPPETS_BLOB_STORAGE` enabled the code and its render are
+        stored as shared, reference counted blobs rather than inline.
+
+        New snippets get an id from `sharding.allocate_snippet_id()` so that
+        their shard can be found from the id alone.
         """
+        code = self.code
+        if self.pk is None:
+            self.pk = sharding.allocate_snippet_id(self.owner_id)
+            if not args:
+                kwargs.setdefault('force_insert', True)
         lexer = get_lexer_by_name(self.language)
         linenos = 'table' if self.linenos else False
         options = {'title': self.title} if self.title else {}
         formatter = HtmlFormatter(style=self.style, linenos=linenos,
                                 full=True, **options)
-        self.highlighted = highlight(self.code, lexer, formatter)
-        super(Snippet, self).save(*args, **kwargs)
\ No newline at end of file
+        self.highlighted = highlight(code, lexer, formatter)
+
+        # Blob references only change for the text that is actually written.
+        update_fields = kwargs.get('update_fields')
+        written = {'code': code, 'highlighted': self.highlighted}
+        if update_fields is not None:
+            written = {name: text for name, text in written.items() if name in update_fields}
+            kwargs['update_fields'] = [*update_fields,
+                                       *(blob_field for name, blob_field in blobs.BLOB_FIELDS
+                                         if name in written)]
+
+        using = kwargs.get('using') or router.db_for_write(Snippet, instance=self)
+        with transaction.atomic(using=using):
+            released = []
+            for name, blob_field in blobs.BLOB_FIELDS:
+                if name not in written:
+                    continue
+                attname = f'{blob_field}_id'
+                released.append(getattr(self, attname))
+                digest = None
+                if blobs.blob_storage_enabled():
+                    digest = blobs.acquire(SnippetBlob, written[name], using)
+                setattr(self, attname, digest)
+            super(Snippet, self).save(*args, **kwargs)
+            for digest in released:
+                blobs.release(SnippetBlob, digest, using)
+
+
+@receiver(post_delete, sender=Snippet)
+def release_snippet_blobs(sender, instance, using, **kwargs):
+    blobs.release(SnippetBlob, instance.code_blob_id, using)
+    blobs.release(SnippetBlob, instance.highlighted_blob_id, using)
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_snippets(sender, instance, using, **kwargs):
+    """
+    The `owner` cascade only reaches the user's own database, so remove
+    snippets kept on another shard explicitly.
+    """
+    shard = sharding.shard_for_owner(instance.pk)
+    if shard != using:
+        Snippet.objects.using(shard).filter(owner_id=instance.pk).delete()
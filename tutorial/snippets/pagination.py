@@ -0,0 +1,9 @@
+from rest_framework.pagination import CursorPagination
+
+
+class SnippetCursorPagination(CursorPagination):
+    """
+    Keyset pagination over a single owner's snippets. Each page is one
+    range scan of the `(owner, created)` index, however deep it is.
+    """
+    ordering = ('created', 'id')
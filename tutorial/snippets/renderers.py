@@ -0,0 +1,47 @@
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from rest_framework import renderers, serializers
+from rest_framework.utils.serializer_helpers import BoundField
+
+# Choice fields with fewer options than this are rendered normally.
+CACHED_CHOICES_MIN = 10
+
+# Rendered <select> fragments with nothing selected, keyed by everything
+# that can change their markup apart from the current value.
+_select_cache = {}
+
+
+class CachedChoicesFormRenderer(renderers.HTMLFormRenderer):
+    """
+    Render large choice fields such as `language` and `style` from a
+    <select> fragment that is built once and reused across requests, only
+    marking the current value as selected.
+    """
+
+    def can_cache(self, field):
+        choice_field = field._field
+        return (isinstance(choice_field, serializers.ChoiceField)
+                and not isinstance(choice_field, serializers.MultipleChoiceField)
+                and not (choice_field.allow_blank or choice_field.allow_null)
+                and len(choice_field.choices) >= CACHED_CHOICES_MIN
+                and not field.errors)
+
+    def render_field(self, field, parent_style):
+        if not self.can_cache(field):
+            return super().render_field(field, parent_style)
+
+        key = (parent_style.get('template_pack', self.template_pack), field.name,
+               field.label, field.help_text, repr(field.style),
+               tuple(field.choices.items()))
+        html = _select_cache.get(key)
+        if html is None:
+            unselected = BoundField(field._field, None, None, field._prefix)
+            html = _select_cache[key] = str(super().render_field(unselected, parent_style))
+
+        value = '' if field.value is None else str(field.value)
+        option = f'<option value="{escape(value)}" '
+        return mark_safe(html.replace(option, option + 'selected', 1))
+
+
+class BrowsableAPIRenderer(renderers.BrowsableAPIRenderer):
+    form_renderer_class = CachedChoicesFormRenderer
@@ -0,0 +1,45 @@
+from django.contrib.auth.models import User
+from snippets.sharding import shard_for_owner, shard_for_snippet
+
+# Snippet data is spread over the shards; everything else, including the
+# shard map itself, lives on the default database.
+SHARDED_MODELS = {'snippet', 'snippetblob'}
+
+
+class ShardRouter:
+    """
+    Route `Snippet` rows to the shard of their owner.
+    """
+
+    def _is_sharded(self, model):
+        return (model._meta.app_label == 'snippets'
+                and model._meta.model_name in SHARDED_MODELS)
+
+    def _db_for_snippet(self, instance):
+        if isinstance(instance, User):
+            # Reverse relations such as `user.snippets`.
+            return shard_for_owner(instance.pk)
+        if getattr(instance, 'owner_id', None) is not None:
+            return shard_for_owner(instance.owner_id)
+        if getattr(instance, 'pk', None) is not None:
+            return shard_for_snippet(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        if not self._is_sharded(model):
+            return 'default'
+        if model._meta.model_name == 'snippet' and 'instance' in hints:
+            return self._db_for_snippet(hints['instance'])
+        # Blobs follow the snippet that references them.
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Snippets point at their owner across databases.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == 'default':
+            return True
+        return app_label == 'snippets' and (model_name is None or model_name in SHARDED_MODELS)
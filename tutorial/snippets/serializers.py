@@ -1,9 +1,37 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from snippets.detection import detect_language, detection_enabled
 from snippets.models import Snippet, LANGUAGE_CHOICES, STYLE_CHOICES
 
+# Processed choices shared by every `SharedChoiceField` with the same list.
+_choices_cache = {}
+
+
+class SharedChoiceField(serializers.ChoiceField):
+    """
+    A `ChoiceField` that works out its lookup tables once per distinct
+    choice list, rather than every time a serializer is instantiated.
+    `LANGUAGE_CHOICES` alone has several hundred entries.
+    """
+
+    def _set_choices(self, choices):
+        try:
+            key = tuple(choices)
+            cached = _choices_cache.get(key)
+        except TypeError:
+            return super()._set_choices(choices)
+        if cached is None:
+            super()._set_choices(choices)
+            _choices_cache[key] = (self.grouped_choices, self._choices,
+                                   self.choice_strings_to_values)
+        else:
+            self.grouped_choices, self._choices, self.choice_strings_to_values = cached
+
+    choices = property(serializers.ChoiceField._get_choices, _set_choices)
+
 
 class SnippetSerializer(serializers.HyperlinkedModelSerializer):
+    serializer_choice_field = SharedChoiceField
     owner = serializers.ReadOnlyField(source='owner.username')
     highlight = serializers.HyperlinkedIdentityField(view_name='snippet-highlight', format='html')
 
@@ -12,10 +40,20 @@ class SnippetSerializer(serializers.HyperlinkedModelSerializer):
         fields = ['url', 'id', 'highlight', 'owner',
                   'title', 'code', 'linenos', 'language', 'style']
 
+    def validate(self, attrs):
+        """
+        Detect the language of new snippets posted without one, when
+        `SNIPPETS_DETECT_LANGUAGE` is enabled.
+        """
+        if self.instance is None and 'language' not in attrs and detection_enabled():
+            attrs['language'] = detect_language(attrs.get('code', ''), attrs.get('title', ''))
+        return attrs
+
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
-    snippets = serializers.HyperlinkedRelatedField(many=True, view_name='snippet-detail', read_only=True)
+    snippet_count = serializers.IntegerField(read_only=True)
+    snippets = serializers.HyperlinkedIdentityField(view_name='user-snippets')
 
     class Meta:
         model = User
-        fields = ['url', 'id', 'username', 'snippets']
\ No newline at end of file
+        fields = ['url', 'id', 'username', 'snippet_count', 'snippets']
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+Placement of snippets across several databases ("shards") by owner.
+
+Every owner falls into one of `BUCKETS` fixed buckets (`owner_id % BUCKETS`)
+and each bucket lives on one database alias from `SNIPPETS_SHARDS`. Buckets
+stay on the first listed shard unless a `ShardBucket` row pins them
+elsewhere, so listing more shards moves nothing by itself: it is
+`manage.py rebalance_snippets` that moves buckets and pins them.
+
+Once snippets are spread over more than one database, their ids are
+allocated as `ticket * BUCKETS + bucket`, so the shard that owns a snippet
+can be found from its id alone without any lookup. Tickets are handed out
+from blocks reserved on the default database, and always above the ids
+the default database numbered itself: while everything lives on a single,
+unpinned shard it numbers snippets without tickets. Those legacy ids don't
+encode a bucket, so lookups by id fall back to the other shards.
+"""
+import heapq
+import threading
+import time
+from functools import partial
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Count, Max
+from django.dispatch import receiver
+
+# Changing this renumbers every bucket, so it is not a setting.
+BUCKETS = 1024
+
+# Seconds a process trusts its copy of the `ShardBucket` overrides.
+SHARD_MAP_TTL = 10
+
+# Tickets reserved per write to the default database.
+TICKET_BLOCK = 128
+
+
+def shard_aliases():
+    return list(getattr(settings, 'SNIPPETS_SHARDS', ['default']))
+
+
+def bucket_for_owner(owner_id):
+    return owner_id % BUCKETS
+
+
+def bucket_for_snippet(snippet_id):
+    return snippet_id % BUCKETS
+
+
+class ShardMap:
+    """
+    Maps buckets to database aliases, caching the `ShardBucket` overrides
+    (which always live on the default database) for `SHARD_MAP_TTL`.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._overrides = None
+        self._loaded_at = 0
+
+    def overrides(self):
+        if self._overrides is None or time.monotonic() - self._loaded_at > SHARD_MAP_TTL:
+            from snippets.models import ShardBucket
+            self._overrides = dict(
+                ShardBucket.objects.using('default').values_list('bucket', 'alias'))
+            self._loaded_at = time.monotonic()
+        return self._overrides
+
+    def shard_for_bucket(self, bucket):
+        # Pins are honoured even with a single shard listed, which is how
+        # data is moved back after shrinking `SNIPPETS_SHARDS`.
+        return self.overrides().get(bucket) or shard_aliases()[0]
+
+    def aliases(self):
+        """
+        Return every alias that can hold snippets: the listed shards, then
+        any that buckets are still pinned to.
+        """
+        aliases = shard_aliases()
+        return aliases + sorted(set(self.overrides().values()) - set(aliases))
+
+    def sharded(self):
+        return len(shard_aliases()) > 1 or bool(self.overrides())
+
+
+shard_map = ShardMap()
+
+
+class TicketAllocator:
+    """
+    Hands out tickets from blocks of `TICKET_BLOCK` reserved on the default
+    database (hi/lo allocation), so that creates on every shard don't all
+    queue for its write lock.
+
+    A block is only reused once its reservation has committed: a rolled
+    back reservation can be handed to another process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.next = self.limit = 0
+
+    def allocate(self):
+        with self.lock:
+            if self.next < self.limit:
+                self.next += 1
+                return self.next - 1
+        start = self.reserve()
+        transaction.on_commit(partial(self.adopt, start + 1, start + TICKET_BLOCK),
+                              using='default')
+        return start
+
+    def adopt(self, start, limit):
+        with self.lock:
+            if self.next >= self.limit:
+                self.next, self.limit = start, limit
+
+    def reserve(self):
+        """
+        Reserve a block on the default database and return its first ticket.
+        The block starts above every id already on the default database, which
+        covers the ids it numbered itself before snippets were sharded.
+        """
+        from snippets.models import Snippet, SnippetTicket
+        max_pk = Snippet.objects.using('default').aggregate(max_pk=Max('pk'))['max_pk'] or 0
+        tickets = SnippetTicket.objects.using('default')
+        while True:
+            block = tickets.create()
+            # Ids keep increasing after the row is gone, so the table stays tiny.
+            tickets.filter(pk=block.pk).delete()
+            if block.pk * TICKET_BLOCK * BUCKETS > max_pk:
+                return block.pk * TICKET_BLOCK
+
+
+tickets = TicketAllocator()
+
+
+@receiver(setting_changed)
+def clear_shard_map(setting, **kwargs):
+    if setting == 'SNIPPETS_SHARDS':
+        shard_map.clear()
+
+
+def shard_for_owner(owner_id):
+    return shard_map.shard_for_bucket(bucket_for_owner(owner_id))
+
+
+def shard_for_snippet(snippet_id):
+    return shard_map.shard_for_bucket(bucket_for_snippet(snippet_id))
+
+
+def allocate_snippet_id(owner_id):
+    """
+    Return a new, globally unique snippet id that encodes the owner's bucket,
+    or `None` to let the database number the snippet when it isn't sharded.
+    """
+    if not shard_map.sharded():
+        return None
+    return tickets.allocate() * BUCKETS + bucket_for_owner(owner_id)
+
+
+def count_snippets_by_owner(owner_ids):
+    """
+    Return `{owner_id: snippet count}` for the given owners, with one
+    grouped query per shard involved.
+    """
+    from snippets.models import Snippet
+    by_shard = defaultdict(list)
+    for owner_id in owner_ids:
+        by_shard[shard_for_owner(owner_id)].append(owner_id)
+    counts = dict.fromkeys(owner_ids, 0)
+    for alias, ids in by_shard.items():
+        counts.update(Snippet.objects.using(alias).filter(owner_id__in=ids)
+                      .order_by().values('owner_id').annotate(count=Count('id'))
+                      .values_list('owner_id', 'count'))
+    return counts
+
+
+class ShardedResults:
+    """
+    A read-only, sliceable view over the same query run on every shard,
+    merged in `Meta.ordering` order (`created`, then `id`).
+
+    Slicing fetches at most `stop` rows from each shard, which is what the
+    paginator needs for a page.
+    """
+    ordered = True
+
+    def __init__(self, queryset, aliases):
+        self.querysets = [queryset.using(alias) for alias in aliases]
+
+    @staticmethod
+    def sort_key(snippet):
+        return snippet.created, snippet.pk
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return heapq.merge(*self.querysets, key=self.sort_key)
+
+    def __getitem__(self, k):
+        if isinstance(k, int):
+            return self[k:k + 1][0]
+        start, stop = k.start or 0, k.stop
+        parts = [queryset[:stop] if stop is not None else queryset
+                 for queryset in self.querysets]
+        return list(islice(heapq.merge(*parts, key=self.sort_key), start, stop))
+
+
+def scatter(queryset):
+    """
+    Return `queryset` spread over every shard, or the queryset itself when
+    there is only one.
+    """
+    aliases = shard_map.aliases()
+    if len(aliases) == 1:
+        return queryset.using(aliases[0])
+    return ShardedResults(queryset.order_by('created', 'pk'), aliases)
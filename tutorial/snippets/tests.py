@@ -1,16 +1,25 @@
 from datetime import datetime
 import io
+from unittest import mock
 from logging import disable
 from django.http import response
-from django.test import TestCase, Client, client
+from django.core.management import call_command
+from django.test import TestCase, Client, client, override_settings
 from django.test.utils import setup_test_environment
+from django.utils.html import escape
 from django.urls import reverse as r
 from django.contrib.auth.models import User
-from snippets.models import Snippet
+from snippets.models import ShardBucket, Snippet, SnippetBlob
+from snippets.sharding import (BUCKETS, bucket_for_owner, bucket_for_snippet, shard_for_owner,
+                               shard_map, tickets)
 from snippets.serializers import SnippetSerializer
-from rest_framework.renderers import JSONRenderer
+from snippets import detection
+from snippets.detection import detect_language
+from snippets.renderers import CachedChoicesFormRenderer
+from rest_framework.renderers import JSONRenderer, HTMLFormRenderer
 from rest_framework.parsers import JSONParser
 from rest_framework import status
+from rest_framework.test import APIRequestFactory
 from random import choice
 import string
 
@@ -49,12 +58,38 @@ def get_user_pk(username):
     return user_pk
 
 def login_user(client, username=TEST_USER, password=TEST_PASS):
-    setup_user()
+    if not User.objects.filter(username=username).exists():
+        setup_user()
     response = client.login(username=username, password=password)
     return response
 
+def fake_highlight(code, lexer, formatter):
+    """Stand-in for `pygments.highlight` in tests that don't test highlighting"""
+    return f'<pre>{escape(code)}</pre>'
 
-class SnippetCreationTests(TestCase):
+
+class SnippetTestCase(TestCase):
+    """
+    Base class for the snippet tests. The test user is created once per
+    class, and Pygments highlighting is stubbed out unless the class sets
+    `stub_highlighting = False`.
+    """
+    stub_highlighting = True
+
+    @classmethod
+    def setUpClass(cls):
+        if cls.stub_highlighting:
+            patcher = mock.patch('snippets.models.highlight', fake_highlight)
+            patcher.start()
+            cls.addClassCleanup(patcher.stop)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        setup_user()
+
+
+class SnippetCreationTests(SnippetTestCase):
     #@disable_test
     def test_snippet_created_date(self):
         """
@@ -104,7 +139,7 @@ class SnippetCreationTests(TestCase):
         )
 
 
-class SnippetSerializerTests(TestCase):
+class SnippetSerializerTests(SnippetTestCase):
     @disable_test
     def test_simple_create(self):
         """
@@ -139,7 +174,7 @@ class SnippetSerializerTests(TestCase):
         )
 
 
-class SnippetJSONRenderTests(TestCase):
+class SnippetJSONRenderTests(SnippetTestCase):
     @disable_test
     def test_simple_JSON_render(self):
         """
@@ -241,7 +276,10 @@ class SnippetJSONRenderTests(TestCase):
         )
 
 
-class JSONAPITests(TestCase):
+class JSONAPITests(SnippetTestCase):
+    #the highlight view is under test here
+    stub_highlighting = False
+
     #@disable_test
     def test_default_pages_no_errors(self):
         """
@@ -416,4 +454,804 @@ class JSONAPITests(TestCase):
             response3.status_code,
             status.HTTP_200_OK,
             msg=f"Reponse returned {response3.status_code} instead of OK 200"
-        )
\ No newline at end of file
+        )
+
+
+class UserSnippetListTests(SnippetTestCase):
+    #@disable_test
+    def test_user_list_links_snippets(self):
+        """
+        Test that the user list shows a snippet count and link instead of every snippet
+        """
+        client = Client()
+        login_user(client)
+        for i in range(3):
+            create_snippet(code_text=f'print({i})')
+
+        response = client.get(r('user-list'))
+        user = response.json()['results'][0]
+
+        #check that the snippet count is correct
+        self.assertEquals(
+            user['snippet_count'],
+            3,
+            msg="User list returned the wrong snippet count"
+        )
+
+        #check that snippets are linked rather than listed
+        self.assertTrue(
+            user['snippets'].endswith(r('user-snippets', args=(user['id'],))),
+            msg="User list did not link to the user's snippets"
+        )
+
+    def check_cursor_pages(self):
+        client = Client()
+        created = [create_snippet(code_text=f'print({i})').pk for i in range(25)]
+        user_pk = get_user_pk(TEST_USER)
+
+        seen = []
+        url = r('user-snippets', args=(user_pk,))
+        while url:
+            #check that every page costs the same: the user and one index range scan
+            with self.assertNumQueries(2):
+                response = client.get(url)
+            seen += [snippet['id'] for snippet in response.data['results']]
+            url = response.data['next']
+
+        #check that every snippet was returned once, in creation order
+        self.assertEquals(
+            seen,
+            created,
+            msg="User snippet pages did not return every snippet in order"
+        )
+
+    #@disable_test
+    def test_user_snippets_cursor_pagination(self):
+        """
+        Test that a user's snippets are paged in creation order with a constant number of queries
+        """
+        self.check_cursor_pages()
+
+    #@disable_test
+    @override_settings(SNIPPETS_BLOB_STORAGE=True)
+    def test_user_snippets_cursor_pagination_with_blobs(self):
+        """
+        Test that paging a user's snippets reads their code blobs without extra queries
+        """
+        self.check_cursor_pages()
+
+    #@disable_test
+    def test_user_snippets_unknown_user(self):
+        """
+        Test that the user snippets endpoint returns 404 for a user that doesn't exist
+        """
+        client = Client()
+        response = client.get(r('user-snippets', args=(get_user_pk(TEST_USER) + 1,)))
+
+        #check if response status code is 404
+        self.assertEquals(
+            response.status_code,
+            status.HTTP_404_NOT_FOUND,
+            msg="Reponse code not 404 as expected"
+        )
+
+
+class LanguageDetectionTests(SnippetTestCase):
+    #@disable_test
+    def test_detect_from_hints(self):
+        """
+        Test that file name, shebang and keyword hints pick the right language
+        """
+        #check that a file name in the title is used
+        self.assertEquals(
+            detect_language('x = 1', 'main.rs'),
+            'rust',
+            msg="File name hint was not used"
+        )
+
+        #check that a shebang line is used
+        self.assertEquals(
+            detect_language('#!/usr/bin/env python3\nx = 1\n'),
+            'python',
+            msg="Shebang hint was not used"
+        )
+
+        #check that keyword fingerprints are used
+        self.assertEquals(
+            detect_language('package main\n\nimport "fmt"\n\nfunc main() {\n\tfmt.Println("hi")\n}\n'),
+            'go',
+            msg="Keyword fingerprints were not used"
+        )
+
+        #check that plain prose falls back to text
+        self.assertEquals(
+            detect_language('This is a test'),
+            'text',
+            msg="Text without code did not fall back to plain text"
+        )
+
+    #@disable_test
+    def test_detect_fingerprints_stay_on_one_line(self):
+        """
+        Test that no fingerprint repeats a whitespace class that spans lines, which backtracks quadratically
+        """
+        for language, patterns in detection.FINGERPRINTS.items():
+            for pattern, weight in patterns:
+                #check that runs of whitespace can't swallow newlines
+                self.assertNotRegex(
+                    pattern.pattern,
+                    r'\\s[*+{]',
+                    msg=f"{language} fingerprint {pattern.pattern!r} repeats \\s across lines"
+                )
+
+    #@disable_test
+    @override_settings(SNIPPETS_DETECT_LANGUAGE_BUDGET=0.05)
+    def test_detect_stops_at_deadline(self):
+        """
+        Test that detection stops fingerprinting and analysing once its budget is spent
+        """
+        code_text = 'def main():\n    import os\n    print(os.name)\n'
+
+        def clock(times):
+            #the first reading starts the budget, every later one is past it
+            readings = iter(times)
+            return lambda: next(readings, 1.0)
+
+        with mock.patch('snippets.detection.time.perf_counter', clock([0.0])), \
+                mock.patch('snippets.detection.find_lexer_class_by_name') as find_lexer:
+            language = detection._detect(code_text, '')
+
+        #check that no fingerprint or analysis ran after the deadline
+        self.assertEquals(
+            (language, find_lexer.called),
+            ('text', False),
+            msg="Detection kept fingerprinting or analysing past its deadline"
+        )
+
+        scores = {'python': 0.6, 'ruby': 0.4}
+        with mock.patch('snippets.detection.fingerprint_scores', return_value=scores), \
+                mock.patch('snippets.detection.time.perf_counter', clock([0.0])), \
+                mock.patch('snippets.detection.find_lexer_class_by_name') as find_lexer:
+            language = detection._detect(code_text, '')
+
+        #check that the best fingerprint is kept without running any analysis
+        self.assertEquals(
+            (language, find_lexer.called),
+            ('python', False),
+            msg="Detection ran analyse_text past its deadline"
+        )
+
+        with mock.patch('snippets.detection.fingerprint_scores', return_value=scores), \
+                mock.patch('snippets.detection.time.perf_counter', clock([0.0] * 10)), \
+                mock.patch('snippets.detection.find_lexer_class_by_name') as find_lexer:
+            find_lexer.return_value.analyse_text.return_value = 0.0
+            detection._detect(code_text, '')
+
+        #check that every candidate is analysed while the budget lasts
+        self.assertEquals(
+            find_lexer.call_count,
+            len(scores),
+            msg="Detection stopped analysing before its deadline"
+        )
+
+    #@disable_test
+    @override_settings(SNIPPETS_DETECT_LANGUAGE=True)
+    def test_API_detects_omitted_language(self):
+        """
+        Test that a snippet posted without a language gets a detected one, but an explicit language is kept
+        """
+        client = Client()
+        login_user(client)
+        code_text = '#include <stdio.h>\n\nint main() {\n    printf("hi");\n}\n'
+
+        response = client.post(r('snippet-list'), {'code': code_text})
+
+        #check that the language was detected
+        self.assertEquals(
+            response.data['language'],
+            'c',
+            msg="Omitted language was not detected"
+        )
+
+        response = client.post(r('snippet-list'), {'code': code_text, 'language': 'text'})
+
+        #check that an explicit language is left alone
+        self.assertEquals(
+            response.data['language'],
+            'text',
+            msg="Explicit language was overridden by detection"
+        )
+
+    #@disable_test
+    def test_API_detection_off_by_default(self):
+        """
+        Test that without detection enabled an omitted language still defaults to python
+        """
+        client = Client()
+        login_user(client)
+        response = client.post(r('snippet-list'), {'code': 'SELECT * FROM snippets;'})
+
+        #check that the model default is used
+        self.assertEquals(
+            response.data['language'],
+            'python',
+            msg="Language was detected although detection is disabled"
+        )
+
+
+class BrowsableAPITests(SnippetTestCase):
+    #@disable_test
+    def test_cached_select_matches_stock_render(self):
+        """
+        Test that cached choice fields render exactly like REST framework's own select
+        """
+        client = Client()
+        login_user(client)
+        snippet = create_snippet(code_text='print(test)')
+        request = APIRequestFactory().get(r('snippet-detail', args=(snippet.pk,)))
+        serializer = SnippetSerializer(snippet, context={'request': request})
+        style = {'template_pack': 'rest_framework/horizontal'}
+
+        for name in ('language', 'style'):
+            for _ in range(2):
+                #check that both the first and the cached render match
+                self.assertEquals(
+                    CachedChoicesFormRenderer().render_field(serializer[name], style),
+                    HTMLFormRenderer().render_field(serializer[name], style),
+                    msg=f"Cached render of {name} differs from the stock render"
+                )
+
+    #@disable_test
+    def test_browsable_detail_selects_value(self):
+        """
+        Test that the browsable API detail page marks the snippet's language as selected
+        """
+        client = Client()
+        login_user(client)
+        response = client.post(r('snippet-list'), {'code': "This is a test", 'language': 'rust'})
+        response = client.get(r('snippet-detail', args=(response.data['id'],)), HTTP_ACCEPT='text/html')
+
+        #check that the page rendered
+        self.assertEquals(
+            response.status_code,
+            status.HTTP_200_OK,
+            msg=f"Browsable API returned {response.status_code} instead of 200 OK"
+        )
+
+        #check that the snippet's language is the selected option
+        self.assertContains(response, '<option value="rust" selected')
+
+
+@override_settings(SNIPPETS_BLOB_STORAGE=True)
+class SnippetBlobStorageTests(SnippetTestCase):
+    #the highlight output is compared with and without blobs
+    stub_highlighting = False
+
+    #@disable_test
+    def test_identical_code_shares_blob(self):
+        """
+        Test that snippets with the same code text share one reference counted blob
+        """
+        client = Client()
+        login_user(client)
+
+        code_text = 'print("Hello, world")\n'
+        snippet1 = create_snippet(code_text=code_text)
+        snippet2 = create_snippet(code_text=code_text)
+
+        #check that both snippets point at the same blob
+        self.assertEquals(
+            snippet1.code_blob_id,
+            snippet2.code_blob_id,
+            msg="Identical code text was not stored in a shared blob"
+        )
+
+        #check that the blob counts both references
+        self.assertEquals(
+            SnippetBlob.objects.get(pk=snippet1.code_blob_id).refcount,
+            2,
+            msg="Shared blob does not count both references"
+        )
+
+        #check that the code is no longer stored inline
+        self.assertEquals(
+            Snippet.objects.filter(pk=snippet1.pk).values_list('code', flat=True).get(),
+            '',
+            msg="Code text is still stored inline"
+        )
+
+        #check that the code text still reads back unchanged
+        self.assertEquals(
+            Snippet.objects.get(pk=snippet1.pk).code,
+            code_text,
+            msg="Code text read from blob does not match original"
+        )
+
+    #@disable_test
+    def test_API_unchanged_with_blobs(self):
+        """
+        Test that the detail and highlight views return the same data with blob storage
+        """
+        client = Client()
+        login_user(client)
+        response1 = client.post(r('snippet-list'), {'code': "This is a test"})
+
+        with override_settings(SNIPPETS_BLOB_STORAGE=False):
+            response2 = client.post(r('snippet-list'), {'code': "This is a test"})
+
+        detail1 = client.get(r('snippet-detail', args=(response1.data['id'],))).json()
+        detail2 = client.get(r('snippet-detail', args=(response2.data['id'],))).json()
+        #check that the highlight view joins its blob: the session, the user and the snippet
+        with self.assertNumQueries(3):
+            highlight1 = client.get(r('snippet-highlight', args=(response1.data['id'],)))
+        highlight2 = client.get(r('snippet-highlight', args=(response2.data['id'],)))
+
+        #check that the serialized code matches the inline snippet
+        self.assertEquals(
+            detail1['code'],
+            detail2['code'],
+            msg="Serialized code differs between blob and inline storage"
+        )
+
+        #check that the highlighted HTML matches the inline snippet
+        self.assertEquals(
+            highlight1.content,
+            highlight2.content,
+            msg="Highlighted HTML differs between blob and inline storage"
+        )
+
+    #@disable_test
+    def test_blobs_collected_when_unreferenced(self):
+        """
+        Test that blobs are only garbage collected once no snippet references them
+        """
+        client = Client()
+        login_user(client)
+
+        snippet1 = create_snippet(code_text='print(test)')
+        snippet2 = create_snippet(code_text='print(test)')
+        digest = snippet1.code_blob_id
+
+        snippet1.delete()
+        call_command('snippet_blobs', 'gc', stdout=io.StringIO())
+
+        #check that a blob still in use is kept
+        self.assertTrue(
+            SnippetBlob.objects.filter(pk=digest).exists(),
+            msg="Blob still referenced by a snippet was collected"
+        )
+
+        snippet2.delete()
+        call_command('snippet_blobs', 'gc', stdout=io.StringIO())
+
+        #check that the blob table is empty once nothing references it
+        self.assertEquals(
+            SnippetBlob.objects.count(),
+            0,
+            msg="Unreferenced blobs were not collected"
+        )
+
+    #@disable_test
+    def test_update_fields_keeps_blob_references(self):
+        """
+        Test that saving only some fields leaves the references of unwritten text alone
+        """
+        snippet = create_snippet(code_text='print(test)')
+        blob_ids = (snippet.code_blob_id, snippet.highlighted_blob_id)
+
+        snippet.title = 'Renamed'
+        snippet.save(update_fields=['title'])
+
+        #check that the snippet still points at the same blobs
+        self.assertEquals(
+            Snippet.objects.filter(pk=snippet.pk).values_list('code_blob', 'highlighted_blob').get(),
+            blob_ids,
+            msg="Saving the title changed the snippet's blobs"
+        )
+
+        #check that no blob gained or lost a reference
+        self.assertEquals(
+            dict(SnippetBlob.objects.values_list('digest', 'refcount')),
+            dict.fromkeys(blob_ids, 1),
+            msg="Saving the title changed blob reference counts"
+        )
+
+        snippet.code = 'print(changed)'
+        snippet.save(update_fields=['code'])
+
+        #check that writing the code moved its reference to a new blob
+        self.assertEquals(
+            Snippet.objects.get(pk=snippet.pk).code,
+            'print(changed)',
+            msg="Saving the code did not update its blob"
+        )
+        self.assertEquals(
+            SnippetBlob.objects.get(pk=blob_ids[0]).refcount,
+            0,
+            msg="Saving the code did not release its old blob"
+        )
+
+    #@disable_test
+    def test_pack_and_unpack_existing_snippets(self):
+        """
+        Test that inline snippets can be moved into blobs and back again
+        """
+        client = Client()
+        login_user(client)
+
+        with override_settings(SNIPPETS_BLOB_STORAGE=False):
+            snippet = create_snippet(code_text='print(test)')
+        highlighted = snippet.highlighted
+
+        call_command('snippet_blobs', 'pack', stdout=io.StringIO())
+        packed = Snippet.objects.get(pk=snippet.pk)
+
+        #check that packing moved the snippet text into blobs
+        self.assertIsNotNone(
+            packed.highlighted_blob_id,
+            msg="Packing did not move the snippet into blobs"
+        )
+
+        #check that the packed snippet still reads back unchanged
+        self.assertEquals(
+            (packed.code, packed.highlighted),
+            ('print(test)', highlighted),
+            msg="Packed snippet text does not match original"
+        )
+
+        call_command('snippet_blobs', 'unpack', stdout=io.StringIO())
+
+        #check that unpacking restored the inline text
+        self.assertEquals(
+            Snippet.objects.filter(pk=snippet.pk).values_list('code', 'highlighted').get(),
+            ('print(test)', highlighted),
+            msg="Unpacking did not restore the inline snippet text"
+        )
+
+
+@override_settings(SNIPPETS_SHARDS=['default', 'shard1', 'shard2'])
+class ShardedSnippetTests(SnippetTestCase):
+    databases = {'default', 'shard1', 'shard2'}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = User.objects.get(username=TEST_USER)
+        #spread the buckets over the shards, as rebalancing would
+        shards = ['default', 'shard1', 'shard2']
+        ShardBucket.objects.bulk_create([ShardBucket(bucket=bucket, alias=shards[bucket % 3])
+                                         for bucket in range(BUCKETS)])
+        shard_map.clear()
+        #pick a second owner that lives on a different shard
+        while True:
+            other = User.objects.create_user(username=create_random_string(), password=TEST_PASS)
+            if shard_for_owner(other.pk) != shard_for_owner(cls.user.pk):
+                break
+        cls.other = other
+
+    def setUp(self):
+        self.addCleanup(shard_map.clear)
+        self.addCleanup(tickets.clear)
+        self.client = Client()
+        login_user(self.client)
+
+    #@disable_test
+    def test_snippets_stored_on_owner_shard(self):
+        """
+        Test that a created snippet is stored on its owner's shard only, with an id encoding its bucket
+        """
+        response = self.client.post(r('snippet-list'), {'code': "This is a test"})
+        shard = shard_for_owner(self.user.pk)
+
+        #check that the snippet is on the owner's shard
+        self.assertTrue(
+            Snippet.objects.using(shard).filter(pk=response.data['id']).exists(),
+            msg="Snippet was not stored on its owner's shard"
+        )
+
+        #check that no other shard holds the snippet
+        self.assertEquals(
+            sum(Snippet.objects.using(alias).count() for alias in ['default', 'shard1', 'shard2']),
+            1,
+            msg="Snippet was stored on more than one shard"
+        )
+
+        #check that the id encodes the owner's bucket
+        self.assertEquals(
+            bucket_for_snippet(response.data['id']),
+            bucket_for_owner(self.user.pk),
+            msg="Snippet id does not encode the owner's bucket"
+        )
+
+    #@disable_test
+    def test_detail_actions_on_shard(self):
+        """
+        Test that detail, highlight, update and delete reach a snippet on its shard
+        """
+        response = self.client.post(r('snippet-list'), {'code': "This is a test"})
+        snippet_id = response.data['id']
+
+        #check that the detail view finds the snippet
+        response = self.client.get(r('snippet-detail', args=(snippet_id,)))
+        self.assertEquals(
+            response.status_code,
+            status.HTTP_200_OK,
+            msg=f"Detail view returned {response.status_code} instead of 200 OK"
+        )
+
+        #check that the highlight view finds the snippet
+        response = self.client.get(r('snippet-highlight', args=(snippet_id,)))
+        self.assertEquals(
+            response.status_code,
+            status.HTTP_200_OK,
+            msg=f"Highlight view returned {response.status_code} instead of 200 OK"
+        )
+
+        response = self.client.put(
+            r('snippet-detail', args=(snippet_id,)),
+            {'code': "Updated"},
+            content_type='application/json'
+        )
+
+        #check that the update was written to the owner's shard
+        self.assertEquals(
+            Snippet.objects.using(shard_for_owner(self.user.pk)).get(pk=snippet_id).code,
+            "Updated",
+            msg="Update was not written to the owner's shard"
+        )
+
+        response = self.client.delete(r('snippet-detail', args=(snippet_id,)))
+
+        #check that the snippet is gone from its shard
+        self.assertFalse(
+            Snippet.objects.using(shard_for_owner(self.user.pk)).filter(pk=snippet_id).exists(),
+            msg="Snippet was not deleted from its shard"
+        )
+
+    #@disable_test
+    def test_list_merges_shards(self):
+        """
+        Test that the snippet list gathers snippets from every shard in creation order
+        """
+        created = []
+        for i in range(3):
+            for owner in (self.user, self.other):
+                created.append(Snippet.objects.create(code=f'print({i})', owner=owner).pk)
+
+        response = self.client.get(r('snippet-list'))
+
+        #check that the count covers every shard
+        self.assertEquals(
+            response.data['count'],
+            len(created),
+            msg="Snippet list count does not cover every shard"
+        )
+
+        #check that the results are merged in creation order
+        self.assertEquals(
+            [snippet['id'] for snippet in response.data['results']],
+            created,
+            msg="Snippet list was not merged in creation order"
+        )
+
+    #@disable_test
+    def test_rebalance_moves_bucket(self):
+        """
+        Test that rebalancing moves a bucket of snippets to another shard
+        """
+        snippet = Snippet.objects.create(code='print(test)', owner=self.user)
+        source = shard_for_owner(self.user.pk)
+        target = next(alias for alias in ['default', 'shard1', 'shard2'] if alias != source)
+
+        call_command('rebalance_snippets', bucket=bucket_for_owner(self.user.pk),
+                     target=target, wait=0, stdout=io.StringIO())
+
+        #check that the owner now maps to the new shard
+        self.assertEquals(
+            shard_for_owner(self.user.pk),
+            target,
+            msg="Shard map was not updated by rebalancing"
+        )
+
+        #check that the snippet was moved intact
+        moved = Snippet.objects.using(target).get(pk=snippet.pk)
+        self.assertEquals(
+            (moved.code, moved.highlighted, moved.created),
+            (snippet.code, snippet.highlighted, snippet.created),
+            msg="Rebalanced snippet does not match the original"
+        )
+
+        #check that the old shard no longer holds the snippet
+        self.assertFalse(
+            Snippet.objects.using(source).filter(pk=snippet.pk).exists(),
+            msg="Rebalanced snippet was left on the old shard"
+        )
+
+        #check that the detail view follows the move
+        response = self.client.get(r('snippet-detail', args=(snippet.pk,)))
+        self.assertEquals(
+            response.status_code,
+            status.HTTP_200_OK,
+            msg=f"Detail view returned {response.status_code} after rebalancing"
+        )
+    #@disable_test
+    def test_rebalance_keeps_writes_made_during_move(self):
+        """
+        Test that snippets written to the old shard while a bucket moves are moved too
+        """
+        kept = Snippet.objects.create(code='print(kept)', owner=self.user)
+        changed = Snippet.objects.create(code='print(old)', owner=self.user)
+        source = shard_for_owner(self.user.pk)
+        target = next(alias for alias in ['default', 'shard1', 'shard2'] if alias != source)
+        late = []
+
+        def stale_writes(seconds):
+            #a process with the old shard map still writes to the old shard
+            late.append(Snippet.objects.using(source).create(code='print(late)', owner=self.user))
+            changed.code = 'print(new)'
+            changed.save(using=source)
+
+        with mock.patch('snippets.management.commands.rebalance_snippets.time.sleep',
+                        stale_writes):
+            call_command('rebalance_snippets', bucket=bucket_for_owner(self.user.pk),
+                         target=target, wait=1, stdout=io.StringIO())
+
+        #check that every snippet, including the late one, is on the new shard
+        self.assertEquals(
+            set(Snippet.objects.using(target).values_list('pk', flat=True)),
+            {kept.pk, changed.pk, late[0].pk},
+            msg="Snippets written during the move were lost"
+        )
+
+        #check that the change made during the move was carried over
+        self.assertEquals(
+            Snippet.objects.using(target).get(pk=changed.pk).code,
+            'print(new)',
+            msg="Change made during the move was lost"
+        )
+
+        #check that the old shard was emptied
+        self.assertFalse(
+            Snippet.objects.using(source).exists(),
+            msg="Rebalanced snippets were left on the old shard"
+        )
+
+    #@disable_test
+    def test_rebalance_shrinks_to_one_shard(self):
+        """
+        Test that pinned buckets are still found, and moved back, after shards are removed
+        """
+        snippets = [Snippet.objects.create(code='print(test)', owner=owner)
+                    for owner in (self.user, self.other)]
+        call_command('rebalance_snippets', pin=True, stdout=io.StringIO())
+
+        with override_settings(SNIPPETS_SHARDS=['default']):
+            #check that pinned snippets are still found before they are moved
+            for snippet in snippets:
+                response = self.client.get(r('snippet-detail', args=(snippet.pk,)))
+                self.assertEquals(
+                    response.status_code,
+                    status.HTTP_200_OK,
+                    msg=f"Detail view returned {response.status_code} for a pinned snippet"
+                )
+
+            call_command('rebalance_snippets', wait=0, stdout=io.StringIO())
+
+            #check that every snippet was moved back to the remaining shard
+            self.assertEquals(
+                set(Snippet.objects.using('default').values_list('pk', flat=True)),
+                {snippet.pk for snippet in snippets},
+                msg="Rebalancing did not move snippets off the removed shards"
+            )
+
+            #check that the list view still shows every snippet
+            response = self.client.get(r('snippet-list'))
+            self.assertEquals(
+                response.data['count'],
+                len(snippets),
+                msg="Snippet list lost snippets after shrinking to one shard"
+            )
+
+    #@disable_test
+    def test_legacy_ids_kept_and_found(self):
+        """
+        Test that snippets numbered before sharding keep their ids and are found after moving
+        """
+        ShardBucket.objects.all().delete()
+        shard_map.clear()
+        with override_settings(SNIPPETS_SHARDS=['default']):
+            first = Snippet.objects.create(code='print(1)', owner=self.user)
+            legacy = Snippet.objects.create(code='print(2)', owner=self.user)
+
+            #check that a single shard lets the database number snippets
+            self.assertEquals(
+                legacy.pk,
+                first.pk + 1,
+                msg="Snippet ids were allocated without sharding"
+            )
+
+            call_command('rebalance_snippets', pin=True, stdout=io.StringIO())
+
+        #move the owner's bucket away from the shard its legacy id points at
+        call_command('rebalance_snippets', bucket=bucket_for_owner(self.user.pk),
+                     target='shard2', wait=0, stdout=io.StringIO())
+        response = self.client.get(r('snippet-detail', args=(legacy.pk,)))
+
+        #check that the legacy id is still found on its new shard
+        self.assertEquals(
+            response.status_code,
+            status.HTTP_200_OK,
+            msg=f"Detail view returned {response.status_code} for a legacy id"
+        )
+
+        #check that newly allocated ids don't clash with legacy ones
+        new = Snippet.objects.create(code='print(3)', owner=self.user)
+        self.assertGreater(
+            new.pk,
+            legacy.pk,
+            msg="Allocated snippet id clashes with legacy ids"
+        )
+
+    #@disable_test
+    def test_unpinned_shards_keep_legacy_snippets(self):
+        """
+        Test that listing more shards without pinning moves nothing and allocates above legacy ids
+        """
+        ShardBucket.objects.all().delete()
+        shard_map.clear()
+        #legacy snippets numbered by the default database, one in the other owner's bucket
+        legacy_pk = BUCKETS + bucket_for_owner(self.other.pk)
+        legacy = Snippet.objects.using('default').create(
+            pk=legacy_pk, code='print(legacy)', owner=self.user)
+        Snippet.objects.using('default').create(pk=legacy_pk + 100, code='print(1)', owner=self.other)
+
+        new = Snippet.objects.create(code='print(new)', owner=self.other)
+
+        #check that allocated ids are above every legacy id
+        self.assertGreater(
+            new.pk,
+            legacy_pk + 100,
+            msg="Allocated snippet id is not above the legacy ids"
+        )
+
+        #check that unpinned buckets stay on the first shard
+        self.assertTrue(
+            Snippet.objects.using('default').filter(pk=new.pk).exists(),
+            msg="Snippet of an unpinned bucket left the first shard"
+        )
+
+        #check that the legacy snippet is still reached by its URL
+        response = self.client.get(r('snippet-detail', args=(legacy.pk,)))
+        self.assertEquals(
+            response.data['code'],
+            'print(legacy)',
+            msg="Legacy snippet URL no longer returns the legacy snippet"
+        )
+
+        #check that the other owner's snippets are all still counted
+        response = self.client.get(r('user-detail', args=(self.other.pk,)))
+        self.assertEquals(
+            response.data['snippet_count'],
+            2,
+            msg="Owner lost snippets when shards were listed without pinning"
+        )
+
+    #@disable_test
+    def test_ticket_blocks_reused(self):
+        """
+        Test that snippet ids come from a block reserved once rather than a write to default per create
+        """
+        owner = self.user if shard_for_owner(self.user.pk) != 'default' else self.other
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Snippet.objects.create(code='print(1)', owner=owner)
+
+        #check that the next create doesn't touch the default database
+        with self.assertNumQueries(0, using='default'):
+            second = Snippet.objects.create(code='print(2)', owner=owner)
+
+        #check that it took the next ticket of the block
+        self.assertEquals(
+            second.pk,
+            first.pk + BUCKETS,
+            msg="Snippet id was not taken from the reserved block"
+        )
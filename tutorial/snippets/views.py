@@ -1,7 +1,10 @@
 from django.contrib.auth.models import User
+from django.http import Http404
 from snippets.models import Snippet
 from snippets.serializers import SnippetSerializer, UserSerializer
+from snippets.pagination import SnippetCursorPagination
 from snippets.permissions import IsOwnerOrReadOnly
+from snippets.sharding import count_snippets_by_owner, scatter, shard_for_snippet, shard_map
 from rest_framework import permissions, renderers, viewsets
 from rest_framework.decorators import api_view, action
 from rest_framework.response import Response
@@ -22,11 +25,48 @@ class SnippetViewSet(viewsets.ModelViewSet):
     `update` and `destroy` actions.
 
     Additionally we also provide an extra `highlight` action.
+
+    Detail actions read straight from the shard encoded in the snippet id,
+    while the list is gathered from every shard.
     """
-    queryset = Snippet.objects.all()
+    queryset = Snippet.objects.select_related('code_blob')
     serializer_class = SnippetSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly,
                           IsOwnerOrReadOnly]
+    # Overrides the shard encoded in the id while looking for a legacy id.
+    shard = None
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'highlight':
+            queryset = queryset.select_related('highlighted_blob')
+        lookup = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if lookup is None:
+            return scatter(queryset)
+        try:
+            return queryset.using(self.shard or shard_for_snippet(int(lookup)))
+        except ValueError:
+            return queryset.none()
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            # Snippets numbered before sharding was enabled have ids that
+            # don't encode their bucket, so look on the other shards too.
+            lookup = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+            if not lookup.isdigit():
+                raise
+            encoded = shard_for_snippet(int(lookup))
+            for alias in shard_map.aliases():
+                if alias == encoded:
+                    continue
+                self.shard = alias
+                try:
+                    return super().get_object()
+                except Http404:
+                    pass
+            raise
 
     @action(detail=True, renderer_classes=[renderers.StaticHTMLRenderer])
     def highlight(self, request, *args, **kwargs):
@@ -40,6 +80,35 @@ class SnippetViewSet(viewsets.ModelViewSet):
 class UserViewSet(viewsets.ReadOnlyModelViewSet):
     """
     This viewset automatically provides `list` and `retrieve` actions.
+
+    Users link to their snippets rather than embedding them; the extra
+    `snippets` action pages through one user's snippets with a cursor.
     """
     queryset = User.objects.all().order_by('id')
-    serializer_class = UserSerializer
\ No newline at end of file
+    serializer_class = UserSerializer
+
+    def set_snippet_counts(self, users):
+        counts = count_snippets_by_owner([user.pk for user in users])
+        for user in users:
+            user.snippet_count = counts[user.pk]
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        self.set_snippet_counts(page if page is not None else queryset)
+        return page
+
+    def get_object(self):
+        user = super().get_object()
+        if self.action == 'retrieve':
+            self.set_snippet_counts([user])
+        return user
+
+    @action(detail=True)
+    def snippets(self, request, *args, **kwargs):
+        user = self.get_object()
+        # Routed to the user's shard, with `owner` already set on each snippet.
+        queryset = user.snippets.select_related('code_blob')
+        paginator = SnippetCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = SnippetSerializer(page, many=True, context=self.get_serializer_context())
+        return paginator.get_paginated_response(serializer.data)
\ No newline at end of file
@@ -0,0 +1,19 @@
+import time
+
+from django.test.runner import DiscoverRunner
+
+
+class TimedTestRunner(DiscoverRunner):
+    """
+    The default test runner, reporting the suite's wall-clock time.
+    Supports `--parallel` like the default runner.
+    """
+
+    def run_tests(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().run_tests(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            workers = f' with {self.parallel} workers' if self.parallel > 1 else ''
+            print(f'Test suite took {elapsed:.2f}s wall-clock{workers}.')
@@ -0,0 +1,2 @@
+def return_key():
+    return "local-test-key"
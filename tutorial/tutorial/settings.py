@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.forms',
     'rest_framework',
     'snippets.apps.SnippetsConfig'
 ]
@@ -58,6 +59,8 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
+        # With DEBUG off Django caches compiled templates, which the browsable
+        # API needs: it otherwise re-parses its templates on every request.
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -70,8 +73,14 @@ TEMPLATES = [
     },
 ]
 
+# Render form widgets (used by the browsable API) through TEMPLATES above,
+# so that they share its template cache when DEBUG is off.
+FORM_RENDERER = 'django.forms.renderers.TemplatesSetting'
+
 WSGI_APPLICATION = 'tutorial.wsgi.application'
 
+TEST_RUNNER = 'tutorial.runner.TimedTestRunner'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
@@ -80,9 +89,24 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    },
+    # Extra databases to shard snippets across, listed in SNIPPETS_SHARDS:
+    # 'shard1': {
+    #     'ENGINE': 'django.db.backends.sqlite3',
+    #     'NAME': BASE_DIR / 'db-shard1.sqlite3',
+    # },
 }
 
+DATABASE_ROUTERS = ['snippets.routers.ShardRouter']
+
+# Database aliases that snippets are spread across by owner.
+# Snippets stay on the first alias listed until they are moved: migrate a
+# new shard with `manage.py migrate --database <alias>`, add it here, then
+# move buckets onto it with `manage.py rebalance_snippets`. Run
+# `rebalance_snippets --pin` before removing or reordering aliases.
+
+SNIPPETS_SHARDS = ['default']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -129,5 +153,24 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10
-}
\ No newline at end of file
+    'PAGE_SIZE': 10,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'snippets.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+
+# Store snippet code and highlighted HTML once per distinct content in the
+# `SnippetBlob` table instead of inline on every `Snippet` row.
+# Run `manage.py snippet_blobs pack` after enabling to convert existing rows.
+
+SNIPPETS_BLOB_STORAGE = False
+
+
+# Detect the language of snippets created without one instead of assuming
+# Python. Detection gives up on expensive analysis after the budget (seconds).
+
+SNIPPETS_DETECT_LANGUAGE = False
+
+SNIPPETS_DETECT_LANGUAGE_BUDGET = 0.05
@@ -0,0 +1,21 @@
+"""
+Settings profile for running the test suite.
+
+`manage.py test` picks this module up unless DJANGO_SETTINGS_MODULE says
+otherwise. It trades realism for speed where the tests don't depend on it.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+# PBKDF2 is deliberately slow; every test user pays for it on creation
+# and on each login.
+PASSWORD_HASHERS = [
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+]
+
+# Shards for the sharding tests, which list them in SNIPPETS_SHARDS.
+DATABASES = {
+    **DATABASES,
+    'shard1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db-shard1.sqlite3'},
+    'shard2': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db-shard2.sqlite3'},
+}